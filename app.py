@@ -6,20 +6,38 @@ Main application with routes for anomaly detection and dashboard
 from flask import Flask, render_template, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail, Message
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
 from datetime import datetime
 import os
 import pandas as pd
 import numpy as np
-from tensorflow.keras.models import load_model
-import tempfile
+import tensorflow as tf
+from tensorflow.keras.models import load_model, clone_model
+import io
 import json
+import sqlite3
+import joblib
+import msgpack
+import zstandard
+import queue
+import threading
+import time
+import hashlib
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from models.preprocess import create_sequences, reconstruction_errors
 
 # Initialize Flask app
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///guardian.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///guardian.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Inference precision: 'float32' (default), 'mixed_float16' or 'mixed_bfloat16'
+app.config['INFERENCE_PRECISION'] = os.environ.get('INFERENCE_PRECISION', 'float32')
+
 # Mail configuration
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
 app.config['MAIL_PORT'] = 465
@@ -32,120 +50,413 @@ app.config['MAIL_DEFAULT_SENDER'] = 'guardian@app.com'
 db = SQLAlchemy(app)
 mail = Mail(app)
 
+# Session for read-only GET routes: nothing is pending, so skip autoflush,
+# and keep loaded rows usable without a refresh
+ReadSession = scoped_session(sessionmaker(autoflush=False, expire_on_commit=False))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling so each scan commit appends to the log instead of syncing the database file"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+# Only this app's engine, not every SQLAlchemy engine in the process
+with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
 
 # Database Models
 class ScanResult(db.Model):
     """Model for storing scan results in database"""
+    __table_args__ = (
+        # Serves newest-first history ordering and cursor pagination
+        db.Index('ix_scan_result_timestamp_id', 'timestamp', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     anomalies_count = db.Column(db.Integer)
-    details = db.Column(db.Text)  # JSON string with anomaly details
+    details = db.Column(db.LargeBinary)  # zstd-compressed msgpack of anomaly details
     
-    def to_dict(self):
+    def to_dict(self, include_details=True):
         """Convert model to dictionary for JSON serialization"""
-        return {
+        result = {
             'id': self.id,
             'timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'anomalies_count': self.anomalies_count,
-            'details': json.loads(self.details) if self.details else []
+            'anomalies_count': self.anomalies_count
         }
+        if include_details:
+            result['details'] = unpack_details(self.details)
+        return result
+
+
+def pack_details(details):
+    """Serialize anomaly details for storage as zstd-compressed msgpack"""
+    return zstandard.ZstdCompressor(level=3).compress(msgpack.packb(details))
+
+
+def unpack_details(blob):
+    """Deserialize stored anomaly details (legacy rows hold plain JSON text)"""
+    if not blob:
+        return []
+    if isinstance(blob, str):
+        return json.loads(blob)
+    return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(blob))
+
+
+def read_session():
+    """Return the request's read-only session, bound to the app's engine"""
+    if not ReadSession.registry.has():
+        return ReadSession(bind=db.engine)
+    return ReadSession()
+
+
+@app.teardown_appcontext
+def remove_read_session(exception=None):
+    """Release the read-only session at the end of each request"""
+    ReadSession.remove()
+
+
+def check_database():
+    """Report whether the database answers a trivial query, rechecked at most every DB_CHECK_INTERVAL seconds"""
+    global DB_CONNECTED, DB_CHECKED_AT
+    
+    now = time.monotonic()
+    if DB_CONNECTED is None or now - DB_CHECKED_AT >= DB_CHECK_INTERVAL:
+        try:
+            read_session().execute(db.text('SELECT 1'))
+            DB_CONNECTED = True
+        except Exception:
+            DB_CONNECTED = False
+        DB_CHECKED_AT = now
+    
+    return DB_CONNECTED
+
+
+def init_database():
+    """Create tables, plus any indexes missing from an existing database"""
+    db.create_all()
+    for index in ScanResult.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
 
 
 # Global variables for model and threshold
 MODEL = None
 THRESHOLD = None
 SCALER = None
+FEATURE_MEAN = None   # float32 training means, one per feature
+FEATURE_SCALE = None  # float32 training std devs, one per feature
+INFERENCE_FN = None   # Compiled forward pass of MODEL
+
+# Sequences per call to the compiled forward pass
+INFERENCE_BATCH_SIZE = 1024
+
+# How long the batcher waits for concurrent uploads to join a batch
+INFERENCE_BATCH_LATENCY_MS = 5
+
+# Longest a request waits for its batched reconstruction before failing
+INFERENCE_TIMEOUT_S = 120
+
+# Scan history page size (default and upper bound for ?limit=)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Cached result of the /status database probe
+DB_CONNECTED = None
+DB_CHECKED_AT = 0.0
+DB_CHECK_INTERVAL = 30  # seconds
+
+# Reconstruction errors of recent uploads, keyed by file content hash and
+# bounded by the total size of the cached arrays
+ERROR_CACHE = OrderedDict()
+ERROR_CACHE_MAX_BYTES = 32 * 1024 * 1024
+ERROR_CACHE_BYTES = 0
+ERROR_CACHE_LOCK = threading.Lock()
+
+# Serializes lazy loading of the model globals across request threads
+MODEL_LOCK = threading.Lock()
 
 
 def load_ml_model():
-    """Load the trained LSTM model and threshold"""
-    global MODEL, THRESHOLD
-    
-    if MODEL is None:
-        model_path = os.path.join('models', 'lstm_model.keras')
-        if os.path.exists(model_path):
-            MODEL = load_model(model_path)
-            print(f"[LOADED] Model loaded from {model_path}")
-        else:
-            print(f"[WARNING] Model not found at {model_path}")
-    
-    if THRESHOLD is None:
-        # Try optimized threshold first, fall back to regular threshold
-        threshold_path = os.path.join('models', 'threshold_optimized.txt')
-        if not os.path.exists(threshold_path):
-            threshold_path = os.path.join('models', 'threshold.txt')
-        
-        if os.path.exists(threshold_path):
-            with open(threshold_path, 'r') as f:
-                THRESHOLD = float(f.read().strip())
-            print(f"[LOADED] Threshold loaded: {THRESHOLD:.6f}")
-        else:
-            THRESHOLD = 0.12  # Default threshold
-            print(f"[WARNING] Threshold file not found, using default: {THRESHOLD}")
-    
-    return MODEL, THRESHOLD
-
-
-def preprocess_for_detection(file_path):
     """
-    Preprocess uploaded CSV file for anomaly detection
+    Load the trained LSTM model, threshold and feature scaler
+    
+    Safe to call from concurrent request threads: loading happens under
+    MODEL_LOCK, and each global is only published once everything it depends
+    on is ready (MODEL last, after its compiled INFERENCE_FN).
+    """
+    global MODEL, THRESHOLD, SCALER, FEATURE_MEAN, FEATURE_SCALE, INFERENCE_FN
+    
+    with MODEL_LOCK:
+        if THRESHOLD is None:
+            # Try optimized threshold first, fall back to regular threshold
+            threshold_path = os.path.join('models', 'threshold_optimized.txt')
+            if not os.path.exists(threshold_path):
+                threshold_path = os.path.join('models', 'threshold.txt')
+            
+            if os.path.exists(threshold_path):
+                with open(threshold_path, 'r') as f:
+                    THRESHOLD = float(f.read().strip())
+                print(f"[LOADED] Threshold loaded: {THRESHOLD:.6f}")
+            else:
+                THRESHOLD = 0.12  # Default threshold
+                print(f"[WARNING] Threshold file not found, using default: {THRESHOLD}")
+        
+        if SCALER is None:
+            scaler_path = os.path.join('models', 'scaler.pkl')
+            if os.path.exists(scaler_path):
+                scaler = joblib.load(scaler_path)
+                # FEATURE_MEAN is the flag readers check, so it goes in after its scale
+                FEATURE_SCALE = scaler.scale_.astype(np.float32)
+                FEATURE_MEAN = scaler.mean_.astype(np.float32)
+                SCALER = scaler
+                clear_error_cache()
+                print(f"[LOADED] Scaler loaded from {scaler_path}")
+            else:
+                print(f"[WARNING] Scaler not found at {scaler_path}, uploads will be scaled on their own statistics")
+        
+        if MODEL is None:
+            model_path = os.path.join('models', 'lstm_model.keras')
+            if os.path.exists(model_path):
+                model = load_model(model_path)
+                print(f"[LOADED] Model loaded from {model_path}")
+                
+                precision = app.config['INFERENCE_PRECISION']
+                if precision != 'float32':
+                    model = convert_model_precision(model, precision)
+                    print(f"[LOADED] Model converted to {precision} inference")
+                
+                inference_fn = build_inference_fn(model)
+                
+                # Warm up so the first upload doesn't pay for tracing and allocation
+                _, timesteps, features = model.input_shape
+                for batch_size in (1, INFERENCE_BATCH_SIZE):
+                    inference_fn(np.zeros((batch_size, timesteps, features), dtype=np.float32))
+                print("[LOADED] Inference graph warmed up")
+                
+                INFERENCE_FN = inference_fn
+                MODEL = model
+                
+                # Errors cached for a previous model no longer apply
+                clear_error_cache()
+            else:
+                print(f"[WARNING] Model not found at {model_path}")
+        
+        return MODEL, THRESHOLD
+
+
+def convert_model_precision(model, policy):
+    """
+    Rebuild a trained model under a reduced-precision dtype policy
+    
+    Layers compute in FP16/BF16 while keeping FP32 variables, so the
+    reconstruction stays close to the FP32 model the threshold was fit on.
     
     Args:
-        file_path: Path to uploaded CSV file
+        model: Trained FP32 Keras model
+        policy: Keras dtype policy name (e.g. 'mixed_bfloat16')
         
     Returns:
-        tuple: (preprocessed_sequences, original_df, feature_names)
+        tf.keras.Model: Model with the same weights running under the policy
     """
-    # Read CSV
-    df = pd.read_csv(file_path)
+    def set_policy(config):
+        # Wrappers such as TimeDistributed serialize their inner layer as a
+        # nested {'class_name': ..., 'config': {...}}, which needs the policy too
+        if 'dtype' in config:
+            config['dtype'] = policy
+        for value in config.values():
+            if isinstance(value, dict) and isinstance(value.get('config'), dict):
+                set_policy(value['config'])
     
-    # Store original data for reporting
-    original_df = df.copy()
+    def clone_layer(layer):
+        config = layer.get_config()
+        set_policy(config)
+        return layer.__class__.from_config(config)
     
-    # Remove timestamp if present
-    if 'ts' in df.columns:
-        df = df.drop('ts', axis=1)
+    converted = clone_model(model, clone_function=clone_layer)
+    converted.set_weights(model.get_weights())
+    return converted
+
+
+def build_inference_fn(model):
+    """
+    Compile the model's forward pass into a single TensorFlow graph
     
-    # Remove label if present (for real-world uploads)
-    has_labels = 'label' in df.columns
-    if has_labels:
-        labels = df['label'].copy()
-        df = df.drop('label', axis=1)
-    else:
-        labels = None
+    Calling the graph directly skips the per-call data adapter and callback
+    machinery of model.predict, which dominates latency on upload-sized inputs.
+    
+    Args:
+        model: Loaded Keras model
+        
+    Returns:
+        tf.function: Callable mapping (N, timesteps, features) float32 to reconstructions
+    """
+    _, timesteps, features = model.input_shape
+    
+    @tf.function(input_signature=[tf.TensorSpec([None, timesteps, features], tf.float32)])
+    def inference_fn(x):
+        return model(x, training=False)
+    
+    return inference_fn
+
+
+def predict_sequences(sequences):
+    """
+    Reconstruct sequences with the compiled model in fixed-size chunks
+    
+    Args:
+        sequences: float32 array of shape (N, timesteps, features)
+        
+    Returns:
+        np.array: float32 reconstructions with the same shape as the input
+    """
+    # TF copies non-contiguous or non-float32 inputs internally on every call
+    if not sequences.flags['C_CONTIGUOUS'] or sequences.dtype != np.float32:
+        warnings.warn(
+            f"predict_sequences received a {sequences.dtype} array "
+            f"(C-contiguous: {sequences.flags['C_CONTIGUOUS']}); converting to contiguous float32",
+            RuntimeWarning
+        )
+        sequences = np.ascontiguousarray(sequences, dtype=np.float32)
+    
+    chunks = [
+        INFERENCE_FN(sequences[i:i + INFERENCE_BATCH_SIZE]).numpy()
+        for i in range(0, len(sequences), INFERENCE_BATCH_SIZE)
+    ]
+    return np.asarray(np.concatenate(chunks), dtype=np.float32)
+
+
+class InferenceBatcher:
+    """
+    Coalesce concurrent inference calls into shared forward passes
+    
+    Requests handled on different worker threads submit their sequences to
+    one background thread, which concatenates everything queued within the
+    latency window (up to max_batch_size sequences), reconstructs it with a
+    single predict_sequences call and hands each caller back its own slice.
+    """
+    
+    def __init__(self, max_batch_size=INFERENCE_BATCH_SIZE,
+                 max_latency_ms=INFERENCE_BATCH_LATENCY_MS):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, sequences):
+        """
+        Reconstruct sequences as part of the next batch
+        
+        Args:
+            sequences: float32 array of shape (N, timesteps, features)
+            
+        Returns:
+            np.array: float32 reconstructions with the same shape as the input
+            
+        Raises:
+            RuntimeError: If no result arrives within INFERENCE_TIMEOUT_S
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((sequences, future))
+        try:
+            return future.result(timeout=INFERENCE_TIMEOUT_S)
+        except FutureTimeoutError:
+            raise RuntimeError(f"Inference timed out after {INFERENCE_TIMEOUT_S}s")
+    
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker owns its own thread
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+    
+    def _collect(self, items):
+        # Appends into the caller's list so nothing is lost if this raises
+        items.append(self._queue.get())
+        count = len(items[0][0])
+        deadline = time.monotonic() + self.max_latency
+        
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            count += len(item[0])
+    
+    def _run(self):
+        while True:
+            items = []
+            
+            # Any failure resolves every collected future, so no caller is left waiting
+            try:
+                self._collect(items)
+                batch = np.concatenate([sequences for sequences, _ in items])
+                reconstructed = predict_sequences(batch)
+                
+                offsets = np.cumsum([len(sequences) for sequences, _ in items])[:-1]
+                for (_, future), part in zip(items, np.split(reconstructed, offsets)):
+                    future.set_result(part)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+BATCHER = InferenceBatcher()
+
+
+def preprocess_for_detection(source):
+    """
+    Preprocess uploaded CSV file for anomaly detection
+    
+    Args:
+        source: Path to a CSV file or in-memory io.BytesIO with its contents
+        
+    Returns:
+        tuple: (preprocessed_sequences, original_df, feature_names)
+    """
+    # Read CSV with the multithreaded Arrow parser
+    df = pd.read_csv(source, engine='pyarrow')
     
     # Expected features
     expected_features = ['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes']
     
-    # Check if all required features are present
+    # Check if all required features are present (ts and label are ignored)
     missing_features = [f for f in expected_features if f not in df.columns]
     if missing_features:
         raise ValueError(f"Missing required features: {missing_features}")
     
-    # Select and order features
-    df = df[expected_features]
-    
-    # Normalize features (simple standardization)
-    from sklearn.preprocessing import StandardScaler
-    scaler = StandardScaler()
-    df_normalized = pd.DataFrame(
-        scaler.fit_transform(df),
-        columns=df.columns
-    )
-    
     # Create sequences (length 10)
     seq_length = 10
-    if len(df_normalized) <= seq_length:
+    if len(df) <= seq_length:
         raise ValueError(f"File must have more than {seq_length} rows for sequence analysis")
     
-    sequences = []
-    for i in range(len(df_normalized) - seq_length):
-        seq = df_normalized.iloc[i:i+seq_length].values
-        sequences.append(seq)
+    # Select features straight into a float32 array; df itself stays
+    # untouched and is returned for reporting
+    arr = df[expected_features].to_numpy(dtype=np.float32, copy=True)
     
-    sequences = np.array(sequences)
+    # Standardize in place with the training statistics, (x - mean) / std
+    if FEATURE_MEAN is not None:
+        mean, scale = FEATURE_MEAN, FEATURE_SCALE
+    else:
+        mean = np.nanmean(arr, axis=0)
+        scale = np.nanstd(arr, axis=0)
+        scale[scale == 0] = 1.0
+    np.subtract(arr, mean, out=arr)
+    np.divide(arr, scale, out=arr)
     
-    return sequences, original_df, expected_features
+    # One contiguous copy of the strided windows, ready for the model
+    sequences = np.ascontiguousarray(create_sequences(arr, seq_length))
+
+    return sequences, df, expected_features
 
 
 def send_email_alert(anomalies_count, details, total_samples):
@@ -156,13 +467,16 @@ def send_email_alert(anomalies_count, details, total_samples):
         anomalies_count: Number of anomalies detected
         details: List of anomaly details
         total_samples: Total number of samples analyzed
+        
+    Returns:
+        str: 'sent', 'skipped' (email not configured) or 'error' (send failed)
     """
     try:
         # Check if email is configured
         if not app.config['MAIL_USERNAME'] or not app.config['MAIL_PASSWORD']:
             print("[WARNING] Email not configured. Skipping email alert.")
             print(f"[ALERT] {anomalies_count} anomalies detected in {total_samples} samples!")
-            return
+            return 'skipped'
         
         # Get recipient from environment or use default
         recipient = os.environ.get('ALERT_EMAIL', 'user@email.com')
@@ -212,20 +526,67 @@ This is an automated alert from Home IoT Guardian.
         # Send email
         mail.send(msg)
         print(f"[EMAIL] Alert sent to {recipient}")
+        return 'sent'
         
     except Exception as e:
         # Handle SMTP errors gracefully
         print(f"[ERROR] Failed to send email: {str(e)}")
         print(f"[ALERT] {anomalies_count} anomalies detected in {total_samples} samples!")
         # Continue execution even if email fails
+        return 'error'
+
+
+def file_digest(source):
+    """Return a BLAKE2b content hash of a CSV path or buffer, used as the error cache key"""
+    if isinstance(source, io.BytesIO):
+        return hashlib.blake2b(source.getbuffer(), digest_size=16).hexdigest()
+    with open(source, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
 
+def get_cached_errors(key):
+    """Look up cached reconstruction errors, marking the entry recently used"""
+    with ERROR_CACHE_LOCK:
+        errors = ERROR_CACHE.get(key)
+        if errors is not None:
+            ERROR_CACHE.move_to_end(key)
+        return errors
 
-def detect_anomalies(file_path):
+
+def cache_errors(key, errors):
+    """Store reconstruction errors, evicting least recently used entries to stay within ERROR_CACHE_MAX_BYTES"""
+    global ERROR_CACHE_BYTES
+    
+    if errors.nbytes > ERROR_CACHE_MAX_BYTES:
+        return
+    
+    with ERROR_CACHE_LOCK:
+        previous = ERROR_CACHE.pop(key, None)
+        if previous is not None:
+            ERROR_CACHE_BYTES -= previous.nbytes
+        
+        ERROR_CACHE[key] = errors
+        ERROR_CACHE_BYTES += errors.nbytes
+        while ERROR_CACHE_BYTES > ERROR_CACHE_MAX_BYTES:
+            _, evicted = ERROR_CACHE.popitem(last=False)
+            ERROR_CACHE_BYTES -= evicted.nbytes
+
+
+def clear_error_cache():
+    """Drop all cached reconstruction errors (they are only valid for the loaded model and scaler)"""
+    global ERROR_CACHE_BYTES
+    
+    with ERROR_CACHE_LOCK:
+        ERROR_CACHE.clear()
+        ERROR_CACHE_BYTES = 0
+
+
+def detect_anomalies(source):
     """
     Detect anomalies in uploaded CSV file
     
     Args:
-        file_path: Path to uploaded CSV file
+        source: Path to a CSV file or in-memory io.BytesIO with its contents
         
     Returns:
         dict: {'anomalies_count': int, 'details': list, 'total_samples': int}
@@ -243,37 +604,51 @@ def detect_anomalies(file_path):
             }
         
         # Preprocess data
-        sequences, original_df, features = preprocess_for_detection(file_path)
+        sequences, original_df, features = preprocess_for_detection(source)
         
-        # Make predictions
-        reconstructed = model.predict(sequences, verbose=0)
+        # Reuse errors from an identical earlier upload when available
+        cache_key = file_digest(source)
+        errors = get_cached_errors(cache_key)
         
-        # Calculate reconstruction errors
-        errors = np.mean(np.square(sequences - reconstructed), axis=(1, 2))
+        if errors is None:
+            # Make predictions (returned in FP32 to keep threshold semantics)
+            reconstructed = BATCHER.submit(sequences)
+            
+            # Calculate reconstruction errors
+            errors = reconstruction_errors(sequences, reconstructed)
+            cache_errors(cache_key, errors)
         
         # Detect anomalies
         anomaly_flags = errors > threshold
         anomaly_indices = np.where(anomaly_flags)[0]
         
         # Prepare detailed results
+        top_indices = anomaly_indices[:100]  # Limit to first 100 anomalies
+        
+        # Fetch the first row of every reported sequence in one gather
+        sample_rows = original_df.iloc[top_indices].to_dict(orient='records')
+        
+        # Classify severity for all reported anomalies at once
+        top_errors = errors[top_indices]
+        severities = np.where(top_errors > threshold * 1.5, 'High', 'Medium').tolist()
+        threshold_value = float(threshold)
+        
         details = []
-        for idx in anomaly_indices[:100]:  # Limit to first 100 anomalies
+        for j, (idx, error, severity) in enumerate(zip(top_indices.tolist(), top_errors.tolist(), severities)):
             # Get the sequence index (accounting for sequence window)
             row_start = idx
             row_end = idx + 10
             
             detail = {
-                'sequence_id': int(idx),
+                'sequence_id': idx,
                 'rows': f"{row_start}-{row_end}",
-                'error': float(errors[idx]),
-                'threshold': float(threshold),
-                'severity': 'High' if errors[idx] > threshold * 1.5 else 'Medium'
+                'error': error,
+                'threshold': threshold_value,
+                'severity': severity
             }
             
             # Add sample data from the sequence
-            if row_start < len(original_df):
-                sample_row = original_df.iloc[row_start].to_dict()
-                detail['sample_data'] = {k: str(v) for k, v in sample_row.items()}
+            detail['sample_data'] = {k: str(v) for k, v in sample_rows[j].items()}
             
             details.append(detail)
         
@@ -337,36 +712,28 @@ def upload_file():
         if not file.filename.endswith('.csv'):
             return jsonify({'error': 'Only CSV files are allowed'}), 400
         
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False) as temp_file:
-            file.save(temp_file.name)
-            temp_path = temp_file.name
+        # Keep the upload in memory (bounded by MAX_CONTENT_LENGTH)
+        csv_buffer = io.BytesIO(file.read())
         
-        try:
-            # Detect anomalies
-            result = detect_anomalies(temp_path)
-            
-            # Check for errors in detection
-            if 'error' in result:
-                return jsonify(result), 500
-            
-            # Store result in database
-            scan_result = ScanResult(
-                anomalies_count=result['anomalies_count'],
-                details=json.dumps(result['details'])
-            )
-            db.session.add(scan_result)
-            db.session.commit()
-            
-            # Add scan ID to result
-            result['scan_id'] = scan_result.id
-            
-            return jsonify(result), 200
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        # Detect anomalies
+        result = detect_anomalies(csv_buffer)
+        
+        # Check for errors in detection
+        if 'error' in result:
+            return jsonify(result), 500
+        
+        # Store result in database
+        scan_result = ScanResult(
+            anomalies_count=result['anomalies_count'],
+            details=pack_details(result['details'])
+        )
+        db.session.add(scan_result)
+        db.session.commit()
+        
+        # Add scan ID to result
+        result['scan_id'] = scan_result.id
+        
+        return jsonify(result), 200
     
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
@@ -377,15 +744,38 @@ def get_history():
     """
     Get scan history from database
     
+    Query parameters:
+        - limit: Number of scans to return (default 50, max 200)
+        - before: ID of the last scan already seen; returns the page after it
+    
     Returns:
-        JSON array of scan results
+        JSON array of scan results (without anomaly details)
     """
     try:
-        # Get all scan results, ordered by most recent first
-        results = ScanResult.query.order_by(ScanResult.timestamp.desc()).limit(50).all()
+        limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        before = request.args.get('before', type=int)
+        
+        # Most recent first; details are only loaded by /scan/<id>
+        session = read_session()
+        query = session.query(ScanResult).options(db.defer(ScanResult.details)).order_by(
+            ScanResult.timestamp.desc(), ScanResult.id.desc()
+        )
+        
+        if before is not None:
+            cursor_timestamp = session.query(ScanResult.timestamp).filter_by(id=before).scalar()
+            if cursor_timestamp is None:
+                return jsonify({'error': 'Invalid history cursor'}), 400
+            
+            query = query.filter(db.or_(
+                ScanResult.timestamp < cursor_timestamp,
+                db.and_(ScanResult.timestamp == cursor_timestamp, ScanResult.id < before)
+            ))
+        
+        results = query.limit(limit).all()
         
         # Convert to dictionary format
-        history = [result.to_dict() for result in results]
+        history = [result.to_dict(include_details=False) for result in results]
         
         return jsonify(history), 200
         
@@ -405,7 +795,7 @@ def get_scan_details(scan_id):
         JSON with detailed scan information
     """
     try:
-        result = ScanResult.query.get(scan_id)
+        result = read_session().get(ScanResult, scan_id)
         
         if result is None:
             return jsonify({'error': 'Scan not found'}), 404
@@ -430,14 +820,10 @@ def get_status():
         model_loaded = model is not None
         
         # Check database
-        db_connected = True
-        try:
-            db.session.execute('SELECT 1')
-        except:
-            db_connected = False
+        db_connected = check_database()
         
         # Get scan count
-        scan_count = ScanResult.query.count()
+        scan_count = read_session().query(ScanResult).count()
         
         return jsonify({
             'status': 'operational',
@@ -468,7 +854,7 @@ def internal_error(error):
 if __name__ == '__main__':
     # Create database tables if they don't exist
     with app.app_context():
-        db.create_all()
+        init_database()
         print("[INFO] Database tables created")
     
     # Load model at startup
@@ -0,0 +1,10 @@
+"""
+Gunicorn configuration for Home IoT Guardian
+Warms up the model in each worker before it accepts requests
+"""
+
+
+def post_worker_init(worker):
+    """Load and warm up the model so no upload pays for it"""
+    from app import load_ml_model
+    load_ml_model()
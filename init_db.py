@@ -3,12 +3,12 @@ Database Initialization Script
 Creates all database tables for Home IoT Guardian
 """
 
-from app import app, db
+from app import app, init_database
 
 if __name__ == '__main__':
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables and indexes
+        init_database()
         print("[SUCCESS] Database tables created successfully!")
         print(f"Database location: guardian.db")
 
@@ -13,7 +13,46 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from preprocess import preprocess_pipeline
-from train_model import calculate_reconstruction_errors, evaluate_model
+from train_model import calculate_reconstruction_errors, metrics_from_confusion
+
+
+def evaluate_thresholds(y_true, errors, thresholds):
+    """
+    Evaluate many candidate thresholds in one pass over the errors
+    
+    Errors are sorted once; for each threshold the number of samples flagged
+    (errors > threshold) and how many of them are malicious come from a
+    searchsorted lookup into cumulative label counts.
+    
+    Args:
+        y_true: True labels (0=benign, 1=malicious)
+        errors: Reconstruction errors
+        thresholds: Candidate anomaly thresholds
+        
+    Returns:
+        list: Evaluation metrics dict for each threshold, in order
+    """
+    y_true = np.asarray(y_true).astype(np.int64)
+    order = np.argsort(errors, kind='stable')
+    sorted_errors = np.asarray(errors)[order]
+    
+    # positives_below[k] = malicious samples among the k smallest errors
+    positives_below = np.concatenate(([0], np.cumsum(y_true[order])))
+    total_positives = positives_below[-1]
+    total_negatives = len(y_true) - total_positives
+    
+    thresholds = np.asarray(thresholds)
+    below = np.searchsorted(sorted_errors, thresholds, side='right')
+    
+    fn = positives_below[below]
+    tn = below - fn
+    tp = total_positives - fn
+    fp = total_negatives - tn
+    
+    return [
+        metrics_from_confusion(int(tp[i]), int(fp[i]), int(tn[i]), int(fn[i]), thresholds[i])
+        for i in range(len(thresholds))
+    ]
 
 
 def find_optimal_threshold(model, X_train, y_train, X_test, y_test, target_fpr=0.10):
@@ -60,11 +99,10 @@ def find_optimal_threshold(model, X_train, y_train, X_test, y_test, target_fpr=0
     best_metrics = None
     best_strategy = None
     
-    for strategy_name, threshold in strategies.items():
-        # Evaluate on test set
-        test_pred = (test_errors > threshold).astype(int)
-        metrics = evaluate_model(y_test, test_pred, test_errors, threshold)
-        
+    # Evaluate all strategies on the test set at once
+    strategy_metrics = evaluate_thresholds(y_test, test_errors, list(strategies.values()))
+    
+    for (strategy_name, threshold), metrics in zip(strategies.items(), strategy_metrics):
         detection_rate = metrics['detection_rate'] * 100
         fpr = metrics['false_positive_rate'] * 100
         
@@ -89,15 +127,13 @@ def find_optimal_threshold(model, X_train, y_train, X_test, y_test, target_fpr=0
     if best_threshold is None:
         print("\nNo strategy met both requirements. Finding best balance...")
         
-        # Sort errors and try thresholds at different percentiles
-        sorted_errors = np.sort(train_errors)
+        # Try thresholds at different percentiles, evaluated together
+        percentiles = np.arange(50, 100)
+        thresholds = np.percentile(train_errors, percentiles)
+        percentile_metrics = evaluate_thresholds(y_test, test_errors, thresholds)
         
         best_score = -1
-        for percentile in range(50, 100):
-            threshold = np.percentile(train_errors, percentile)
-            test_pred = (test_errors > threshold).astype(int)
-            metrics = evaluate_model(y_test, test_pred, test_errors, threshold)
-            
+        for percentile, threshold, metrics in zip(percentiles, thresholds, percentile_metrics):
             # Score = detection_rate - fpr_penalty
             # Penalize FPR more if it exceeds target
             fpr_penalty = metrics['false_positive_rate'] * (2 if metrics['false_positive_rate'] > target_fpr else 1)
@@ -145,22 +181,15 @@ if __name__ == "__main__":
     
     # Load data without timestamp column
     df = pd.read_csv(data_path)
-    df = df.drop('ts', axis=1)
-    temp_path = data_path.replace('.csv', '_temp_optimize.csv')
-    df.to_csv(temp_path, index=False)
     
     result = preprocess_pipeline(
-        file_path=temp_path,
+        df=df.drop('ts', axis=1),
         numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
         label_col='label',
         create_seq=True,
         seq_length=10
     )
     
-    # Clean up temp file
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
-    
     X_train = result['X_train']
     X_test = result['X_test']
     y_train = result['y_train']
@@ -6,26 +6,198 @@ Handles loading, cleaning, and preparing IoT traffic data for ML models
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
+from joblib import Parallel, delayed
 
 
-def load_csv(file_path):
+def load_csv(file_path, verbose=False):
     """
-    Load CSV file with pandas
+    Load CSV file with pandas using the multithreaded Arrow parser
     
     Args:
         file_path (str): Path to the CSV file
+        verbose (bool): Print progress
         
     Returns:
         pd.DataFrame: Loaded dataframe
     """
-    print(f"Loading data from {file_path}...")
-    df = pd.read_csv(file_path)
-    print(f"Data loaded: {df.shape[0]} rows, {df.shape[1]} columns")
+    if verbose:
+        print(f"Loading data from {file_path}...")
+    df = pd.read_csv(file_path, engine='pyarrow')
+    if verbose:
+        print(f"Data loaded: {df.shape[0]} rows, {df.shape[1]} columns")
     return df
 
 
-def clean_data(df, numeric_cols=None, categorical_cols=None):
+def encode_labels(labels):
+    """
+    Encode labels as integers
+    
+    String labels map benign/malicious to 0/1 through categorical codes
+    (one hash lookup per row instead of a Python dict lookup per object).
+    
+    Args:
+        labels (pd.Series): Label column
+        
+    Returns:
+        np.array: int8 codes for string labels, otherwise the raw label values
+    """
+    if labels.dtype == 'object':
+        return np.asarray(pd.Categorical(labels, categories=['benign', 'malicious']).codes, dtype=np.int8)
+    return labels.to_numpy()
+
+
+def iter_batches(file_path, batch_size=50_000, usecols=None):
+    """
+    Read a CSV file in batches of rows
+    
+    Args:
+        file_path (str): Path to the CSV file
+        batch_size (int): Maximum rows per batch
+        usecols (list or callable): Columns to parse (default: all)
+        
+    Yields:
+        pd.DataFrame: Next batch of rows
+    """
+    with pd.read_csv(file_path, usecols=usecols, chunksize=batch_size) as reader:
+        yield from reader
+
+
+def load_batched(file_path, numeric_cols, label_col=None, batch_size=50_000, scaler=None,
+                 verbose=False):
+    """
+    Stream a CSV file into a standardized numeric feature block
+    
+    Only the numeric and label columns are parsed, one batch at a time. Rows
+    with missing values are dropped per batch and the StandardScaler is fit
+    incrementally, so the full DataFrame is never held in memory.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        numeric_cols (list): Numeric columns to normalize
+        label_col (str): Name of label column (if any)
+        batch_size (int): Maximum rows per batch
+        scaler (StandardScaler): Already-fitted scaler to apply instead of fitting one
+        verbose (bool): Print progress
+        
+    Returns:
+        tuple: (features_df, labels, scaler) - float32 features, labels is None without label_col
+    """
+    wanted = set(numeric_cols) | ({label_col} if label_col else set())
+    
+    blocks, label_blocks = [], []
+    fit_scaler = scaler is None
+    if fit_scaler:
+        scaler = StandardScaler()
+    columns = None
+    
+    if verbose:
+        print(f"Streaming data from {file_path} in batches of {batch_size} rows...")
+    for batch in iter_batches(file_path, batch_size, usecols=lambda col: col in wanted):
+        batch = batch[~missing_rows(batch)]
+        if columns is None:
+            columns = [col for col in numeric_cols if col in batch.columns]
+        if len(batch) == 0:
+            continue
+        
+        block = batch[columns].to_numpy(dtype=np.float32)
+        if fit_scaler:
+            scaler.partial_fit(block)
+        blocks.append(block)
+        
+        if label_col and label_col in batch.columns:
+            label_blocks.append(encode_labels(batch[label_col]))
+    
+    if not blocks:
+        raise ValueError(f"No complete rows found in {file_path}")
+    
+    # Standardize in place with the scaler's statistics, (x - mean) / std
+    features = np.concatenate(blocks)
+    np.subtract(features, scaler.mean_, out=features)
+    np.divide(features, scaler.scale_, out=features)
+    if verbose:
+        print(f"Data streamed: {features.shape[0]} rows, {features.shape[1]} features")
+    
+    labels = np.concatenate(label_blocks) if label_blocks else None
+    return pd.DataFrame(features, columns=columns, copy=False), labels, scaler
+
+
+def missing_rows(df):
+    """
+    Flag rows holding any missing value
+    
+    Float columns are checked with a single np.isnan pass over one block;
+    plain NumPy int/bool columns cannot hold NaN and are skipped, and only
+    the remaining (object, extension) columns go through pandas.
+    
+    Args:
+        df (pd.DataFrame): Input dataframe
+        
+    Returns:
+        np.array: Boolean mask, True for rows with a missing value
+    """
+    missing = np.zeros(len(df), dtype=bool)
+    
+    float_cols = [col for col, dtype in df.dtypes.items()
+                  if isinstance(dtype, np.dtype) and dtype.kind == 'f']
+    if float_cols:
+        missing |= np.isnan(df[float_cols].to_numpy()).any(axis=1)
+    
+    other_cols = [col for col, dtype in df.dtypes.items()
+                  if not (isinstance(dtype, np.dtype) and dtype.kind in 'fiub')]
+    if other_cols:
+        missing |= df[other_cols].isna().to_numpy().any(axis=1)
+    
+    return missing
+
+
+def fit_scaler_gpu(block):
+    """
+    Fit and apply standardization on the GPU with CuPy
+    
+    The statistics are returned in a regular sklearn StandardScaler, so the
+    saved scaler still loads for inference on machines without a GPU.
+    
+    Args:
+        block (np.array): float32 numeric block, standardized in place
+        
+    Returns:
+        StandardScaler: Scaler carrying the block's mean and variance
+    """
+    import cupy as cp  # optional, only needed for use_gpu=True
+    
+    block_gpu = cp.asarray(block)
+    mean = block_gpu.mean(axis=0, dtype=cp.float64)
+    var = block_gpu.var(axis=0, dtype=cp.float64)
+    scale = cp.sqrt(var)
+    scale[scale == 0] = 1.0
+    
+    block_gpu -= mean.astype(cp.float32)
+    block_gpu /= scale.astype(cp.float32)
+    block[...] = cp.asnumpy(block_gpu)
+    
+    scaler = StandardScaler()
+    scaler.mean_ = cp.asnumpy(mean)
+    scaler.var_ = cp.asnumpy(var)
+    scaler.scale_ = cp.asnumpy(scale)
+    scaler.n_samples_seen_ = block.shape[0]
+    scaler.n_features_in_ = block.shape[1]
+    return scaler
+
+
+def _encode_one(series, col):
+    """One-hot encode a column into int8 <col>_<value> columns"""
+    cat = pd.Categorical(series)
+    
+    # Scatter a 1 into each row's category column
+    one_hot = np.zeros((len(cat), len(cat.categories)), dtype=np.int8)
+    one_hot[np.arange(len(cat)), cat.codes] = 1
+    
+    columns = [f"{col}_{value}" for value in cat.categories]
+    return pd.DataFrame(one_hot, columns=columns, index=series.index)
+
+
+def clean_data(df, numeric_cols=None, categorical_cols=None, scaler=None, use_gpu=False,
+               verbose=False):
     """
     Clean data: drop NaN values and encode categorical variables
     
@@ -33,144 +205,217 @@ def clean_data(df, numeric_cols=None, categorical_cols=None):
         df (pd.DataFrame): Input dataframe
         numeric_cols (list): List of numeric columns to normalize
         categorical_cols (list): List of categorical columns to encode
+        scaler (StandardScaler): Already-fitted scaler (e.g. from training) to
+            apply instead of fitting one on df
+        use_gpu (bool): Fit and apply the scaler on the GPU (requires cupy)
+        verbose (bool): Print progress
         
     Returns:
         tuple: (cleaned_df, scaler, encoded_columns)
     """
-    print(f"Cleaning data... Initial shape: {df.shape}")
+    if verbose:
+        print(f"Cleaning data... Initial shape: {df.shape}")
     
     # Drop rows with missing values
-    df_clean = df.dropna()
-    print(f"After dropping NaN: {df_clean.shape}")
+    missing = missing_rows(df)
+    df_clean = df.iloc[np.flatnonzero(~missing)] if missing.any() else df.copy()
+    if verbose:
+        print(f"After dropping NaN: {df_clean.shape}")
     
-    # Encode categorical variables with pd.get_dummies if specified
+    # One-hot encode categorical variables if specified
     encoded_columns = []
     if categorical_cols:
-        for col in categorical_cols:
-            if col in df_clean.columns:
-                print(f"Encoding categorical column: {col}")
-                dummies = pd.get_dummies(df_clean[col], prefix=col, drop_first=False)
-                encoded_columns.extend(dummies.columns.tolist())
-                df_clean = pd.concat([df_clean.drop(col, axis=1), dummies], axis=1)
+        encoded_sources = [col for col in categorical_cols if col in df_clean.columns]
+        if encoded_sources and verbose:
+            print(f"Encoding categorical columns: {encoded_sources}")
+        
+        # Encode columns concurrently (the NumPy/pandas work releases the GIL)
+        encoded_blocks = Parallel(n_jobs=-1, prefer='threads')(
+            delayed(_encode_one)(df_clean[col], col) for col in encoded_sources
+        )
+        for block in encoded_blocks:
+            encoded_columns.extend(block.columns.tolist())
+        
+        # Swap all encoded columns in with a single concat that reuses the
+        # existing blocks instead of copying them again
+        if encoded_blocks:
+            df_clean = pd.concat(
+                [df_clean.drop(columns=encoded_sources)] + encoded_blocks, axis=1, copy=False
+            )
     
     # Normalize numerical features with StandardScaler if specified
-    scaler = None
     if numeric_cols:
         numeric_cols_present = [col for col in numeric_cols if col in df_clean.columns]
         if numeric_cols_present:
-            print(f"Normalizing numerical columns: {numeric_cols_present}")
-            scaler = StandardScaler()
-            df_clean[numeric_cols_present] = scaler.fit_transform(df_clean[numeric_cols_present])
+            if verbose:
+                print(f"Normalizing numerical columns: {numeric_cols_present}")
+            # float32 matches the LSTM's input precision and halves memory;
+            # the scaler still accumulates its statistics in float64
+            block = df_clean[numeric_cols_present].to_numpy(dtype=np.float32, copy=True)
+            
+            if scaler is None and use_gpu:
+                scaler = fit_scaler_gpu(block)
+            else:
+                # Fit the running mean/variance (unless given a fitted scaler),
+                # then standardize with one in-place NumPy sweep
+                if scaler is None:
+                    scaler = StandardScaler().partial_fit(block)
+                np.subtract(block, scaler.mean_, out=block)
+                np.divide(block, scaler.scale_, out=block)
+            df_clean[numeric_cols_present] = block
     
-    print(f"Cleaning complete. Final shape: {df_clean.shape}")
+    if verbose:
+        print(f"Cleaning complete. Final shape: {df_clean.shape}")
     return df_clean, scaler, encoded_columns
 
 
-def create_sequences(data, seq_length=10):
+def create_sequences(data, seq_length=10, verbose=False):
     """
     Create time-series sequences for LSTM models
     
     Args:
         data (np.array or pd.DataFrame): Input data
         seq_length (int): Length of each sequence (default: 10)
+        verbose (bool): Print progress
         
     Returns:
-        np.array: Array of sequences with shape (num_sequences, seq_length, num_features)
+        np.array: Read-only strided view of shape (num_sequences, seq_length, num_features)
     """
-    # Convert to numpy array if it's a DataFrame
+    # Convert to a contiguous float32 numpy array if it's a DataFrame
     if isinstance(data, pd.DataFrame):
         data = data.values
+    data = np.ascontiguousarray(data, dtype=np.float32)
     
     if len(data) <= seq_length:
         print(f"Warning: Data length ({len(data)}) is less than or equal to sequence length ({seq_length})")
         return np.array([])
     
-    sequences = []
-    for i in range(len(data) - seq_length):
-        seq = data[i:i + seq_length]
-        sequences.append(seq)
-    
-    sequences = np.array(sequences)
-    print(f"Created {sequences.shape[0]} sequences of length {seq_length}")
-    print(f"Sequence shape: {sequences.shape}")
+    # Build all windows as one zero-copy view, dropping the final window to
+    # keep one sequence per row in range(len(data) - seq_length)
+    windows = np.lib.stride_tricks.sliding_window_view(data, (seq_length, data.shape[1]))[:, 0]
+    sequences = windows[:-1]
+    if verbose:
+        print(f"Created {sequences.shape[0]} sequences of length {seq_length}")
+        print(f"Sequence shape: {sequences.shape}")
     
     return sequences
 
 
-def split_train_test(X, y=None, test_size=0.2, random_state=42):
+def reconstruction_errors(sequences, reconstructed):
+    """
+    Mean squared reconstruction error per sequence
+    
+    Takes one difference buffer and reduces its squares with a single einsum,
+    so no separate squared temporary is allocated. Neither input is modified.
+    
+    Args:
+        sequences: Model input of shape (N, seq_length, features)
+        reconstructed: Model output of the same shape
+        
+    Returns:
+        np.array: MSE for each sequence, shape (N,)
+    """
+    diff = np.subtract(sequences, reconstructed)
+    errors = np.einsum('ijk,ijk->i', diff, diff)
+    errors /= diff.shape[1] * diff.shape[2]
+    return errors
+
+
+def split_train_test(X, y=None, test_size=0.2, random_state=42, verbose=False):
     """
     Split data into training and testing sets (80/20 by default)
     
     Args:
-        X (np.array or pd.DataFrame): Features
-        y (np.array or pd.Series): Labels (optional)
+        X (np.array): Features
+        y (np.array): Labels (optional)
         test_size (float): Proportion of test set (default: 0.2)
         random_state (int): Random seed for reproducibility
+        verbose (bool): Print progress
         
     Returns:
         tuple: (X_train, X_test, y_train, y_test) or (X_train, X_test) if y is None
     """
-    if y is not None:
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=random_state
-        )
-        print(f"Train set: {X_train.shape[0]} samples")
-        print(f"Test set: {X_test.shape[0]} samples")
-        return X_train, X_test, y_train, y_test
-    else:
-        X_train, X_test = train_test_split(
-            X, test_size=test_size, random_state=random_state
-        )
+    # One permutation shared by X and y; RandomState(seed).permutation with a
+    # ceil-sized test slice reproduces sklearn's train_test_split exactly
+    n_samples = len(X)
+    n_test = int(np.ceil(test_size * n_samples))
+    perm = np.random.RandomState(random_state).permutation(n_samples)
+    test_idx, train_idx = perm[:n_test], perm[n_test:]
+    
+    X_train, X_test = X[train_idx], X[test_idx]
+    if verbose:
         print(f"Train set: {X_train.shape[0]} samples")
         print(f"Test set: {X_test.shape[0]} samples")
-        return X_train, X_test
+    
+    if y is not None:
+        return X_train, X_test, y[train_idx], y[test_idx]
+    return X_train, X_test
 
 
-def preprocess_pipeline(file_path, numeric_cols, categorical_cols=None, 
-                        label_col=None, create_seq=False, seq_length=10):
+def preprocess_pipeline(file_path=None, numeric_cols=None, categorical_cols=None, 
+                        label_col=None, create_seq=False, seq_length=10, df=None,
+                        batch_size=None, scaler=None, use_gpu=False, verbose=False):
     """
     Complete preprocessing pipeline
     
     Args:
-        file_path (str): Path to CSV file
+        file_path (str): Path to CSV file (ignored if df is given)
         numeric_cols (list): Numeric columns to normalize
         categorical_cols (list): Categorical columns to encode
         label_col (str): Name of label column (if any)
         create_seq (bool): Whether to create sequences for LSTM
         seq_length (int): Length of sequences (if create_seq=True)
+        df (pd.DataFrame): Already-loaded data, used instead of reading file_path
+        batch_size (int): Stream file_path in batches of this many rows, keeping
+            only numeric_cols and label_col (not supported with categorical_cols)
+        scaler (StandardScaler): Already-fitted scaler to apply instead of fitting one
+        use_gpu (bool): Fit the scaler on the GPU (requires cupy, in-memory mode only)
+        verbose (bool): Print progress from every step
         
     Returns:
         dict: Dictionary containing processed data and metadata
     """
-    # Load data
-    df = load_csv(file_path)
-    
-    # Separate labels if specified
-    y = None
-    if label_col and label_col in df.columns:
-        y = df[label_col].copy()
-        # Encode labels if they're categorical
-        if y.dtype == 'object':
-            y = y.map({'benign': 0, 'malicious': 1})
-        df = df.drop(label_col, axis=1)
-    
-    # Clean and encode data
-    df_clean, scaler, encoded_cols = clean_data(df, numeric_cols, categorical_cols)
+    if df is None and batch_size is not None:
+        if file_path is None or not numeric_cols:
+            raise ValueError("batch_size requires file_path and numeric_cols")
+        if categorical_cols:
+            raise ValueError("categorical_cols are not supported with batch_size")
+        
+        # Stream the file instead of loading it whole
+        df_clean, y, scaler = load_batched(
+            file_path, numeric_cols, label_col, batch_size, scaler, verbose
+        )
+        encoded_cols = []
+    else:
+        # Load data unless the caller already has it in memory
+        if df is None:
+            if file_path is None:
+                raise ValueError("Either file_path or df must be provided")
+            df = load_csv(file_path, verbose)
+        
+        # Separate labels if specified
+        y = None
+        if label_col and label_col in df.columns:
+            y = encode_labels(df[label_col])
+            df = df.drop(label_col, axis=1)
+        
+        # Clean and encode data
+        df_clean, scaler, encoded_cols = clean_data(
+            df, numeric_cols, categorical_cols, scaler, use_gpu, verbose
+        )
     
     # Create sequences if requested
     if create_seq:
-        X = create_sequences(df_clean, seq_length)
+        X = create_sequences(df_clean, seq_length, verbose)
         if y is not None and len(X) > 0:
             # Adjust labels to match sequence count
-            y = y[seq_length:].values
+            y = y[seq_length:]
     else:
         X = df_clean.values
-        if y is not None:
-            y = y.values
     
     # Split train/test
     if y is not None:
-        X_train, X_test, y_train, y_test = split_train_test(X, y)
+        X_train, X_test, y_train, y_test = split_train_test(X, y, verbose=verbose)
         
         return {
             'X_train': X_train,
@@ -182,7 +427,7 @@ def preprocess_pipeline(file_path, numeric_cols, categorical_cols=None,
             'feature_names': df_clean.columns.tolist()
         }
     else:
-        X_train, X_test = split_train_test(X)
+        X_train, X_test = split_train_test(X, verbose=verbose)
         
         return {
             'X_train': X_train,
@@ -211,7 +456,8 @@ if __name__ == "__main__":
         file_path=test_file,
         numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
         label_col='label',
-        create_seq=False
+        create_seq=False,
+        verbose=True
     )
     
     print(f"\nResults:")
@@ -227,7 +473,8 @@ if __name__ == "__main__":
         numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
         label_col='label',
         create_seq=True,
-        seq_length=10
+        seq_length=10,
+        verbose=True
     )
     
     print(f"\nResults with sequences:")
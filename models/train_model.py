@@ -4,6 +4,10 @@ Trains an anomaly detection model using LSTM autoencoder architecture
 """
 
 import os
+import hashlib
+import weakref
+from collections import OrderedDict
+import joblib
 import numpy as np
 import pandas as pd
 import tensorflow as tf
@@ -11,11 +15,11 @@ from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import LSTM, Dense, RepeatVector, TimeDistributed
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import confusion_matrix, classification_report
+from sklearn.metrics import classification_report
 import matplotlib.pyplot as plt
 
 # Import preprocessing functions
-from preprocess import preprocess_pipeline
+from preprocess import preprocess_pipeline, reconstruction_errors
 
 
 def build_lstm_autoencoder(timesteps, features):
@@ -32,22 +36,27 @@ def build_lstm_autoencoder(timesteps, features):
     print(f"\nBuilding LSTM Autoencoder...")
     print(f"Input shape: ({timesteps}, {features})")
     
+    # tanh/sigmoid activations (the LSTM defaults) let TensorFlow run the
+    # fused CuDNN kernel on GPU instead of the generic RNN loop
     model = Sequential([
         # Encoder
-        LSTM(50, activation='relu', input_shape=(timesteps, features), return_sequences=True),
-        LSTM(20, activation='relu', return_sequences=False),
+        LSTM(50, activation='tanh', recurrent_activation='sigmoid',
+             input_shape=(timesteps, features), return_sequences=True),
+        LSTM(20, activation='tanh', recurrent_activation='sigmoid', return_sequences=False),
         
         # Decoder
         RepeatVector(timesteps),
-        LSTM(20, activation='relu', return_sequences=True),
-        LSTM(50, activation='relu', return_sequences=True),
+        LSTM(20, activation='tanh', recurrent_activation='sigmoid', return_sequences=True),
+        LSTM(50, activation='tanh', recurrent_activation='sigmoid', return_sequences=True),
         
         # Output layer
         TimeDistributed(Dense(features))
     ])
     
-    # Compile model
-    model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+    # Compile model. On CPU, XLA fuses the train step (shapes are static); on
+    # GPU the LSTMs run the CuDNN kernel, which XLA cannot compile, so leave it off
+    use_xla = not tf.config.list_physical_devices('GPU')
+    model.compile(optimizer='adam', loss='mse', metrics=['mae'], jit_compile=use_xla)
     
     print("\nModel Architecture:")
     model.summary()
@@ -55,22 +64,74 @@ def build_lstm_autoencoder(timesteps, features):
     return model
 
 
-def calculate_reconstruction_errors(model, X):
+# Reconstruction errors per model, keyed by weights and input content
+_ERROR_CACHE = weakref.WeakKeyDictionary()
+
+# Most recent inputs whose errors are kept per model
+ERROR_CACHE_SIZE = 4
+
+# Sequences per forward pass when computing reconstruction errors
+ERROR_BATCH_SIZE = 1024
+
+# Training sequences held in the shuffle buffer of the input pipeline
+SHUFFLE_BUFFER_SIZE = 8192
+
+
+@tf.function(reduce_retracing=True)
+def _reconstruction_mse(model, x):
+    """Per-sample reconstruction MSE, reduced on-device so only N scalars leave the graph"""
+    reconstructed = tf.cast(model(x, training=False), x.dtype)
+    return tf.reduce_mean(tf.square(x - reconstructed), axis=[1, 2])
+
+
+def _errors_cache_key(model, X):
+    """Key identifying X's contents and the model's current weights"""
+    # Hash the weights themselves: load_weights(), set_weights() and
+    # restore_best_weights all change them without advancing the optimizer
+    weights = hashlib.blake2b(digest_size=16)
+    for w in model.get_weights():
+        weights.update(np.ascontiguousarray(w).data)
+    
+    X = np.ascontiguousarray(X)
+    digest = hashlib.blake2b(X.data, digest_size=16).hexdigest()
+    return (weights.hexdigest(), X.shape, X.dtype.str, digest)
+
+
+def calculate_reconstruction_errors(model, X, use_cache=True):
     """
     Calculate reconstruction errors for anomaly detection
     
+    Results are memoized per model, so repeated calls on the same data (e.g.
+    threshold selection followed by evaluation) skip the forward pass. Any
+    change to the weights invalidates earlier entries, and only the last
+    ERROR_CACHE_SIZE inputs are kept.
+    
     Args:
         model: Trained autoencoder model
         X: Input sequences
+        use_cache: Reuse errors from an earlier call with identical inputs
         
     Returns:
-        np.array: Reconstruction errors (MSE) for each sample
+        np.array: Reconstruction errors (MSE) for each sample (read-only when cached)
     """
-    # Reconstruct the input
-    X_reconstructed = model.predict(X, verbose=0)
-    
-    # Calculate MSE for each sample
-    mse = np.mean(np.square(X - X_reconstructed), axis=(1, 2))
+    if use_cache:
+        key = _errors_cache_key(model, X)
+        model_cache = _ERROR_CACHE.setdefault(model, OrderedDict())
+        if key in model_cache:
+            model_cache.move_to_end(key)
+            return model_cache[key]
+    
+    # Reconstruct the input and calculate MSE for each sample in one graph,
+    # staging the next batch while the current one runs
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(X, dtype=np.float32))
+    dataset = dataset.batch(ERROR_BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
+    mse = np.concatenate([_reconstruction_mse(model, batch).numpy() for batch in dataset])
+    
+    if use_cache:
+        mse.flags.writeable = False
+        model_cache[key] = mse
+        if len(model_cache) > ERROR_CACHE_SIZE:
+            model_cache.popitem(last=False)
     
     return mse
 
@@ -101,7 +162,7 @@ def determine_threshold(train_errors, method='mean_std', std_multiplier=3):
     return threshold
 
 
-def detect_anomalies(model, X, threshold):
+def detect_anomalies(model, X, threshold, errors=None):
     """
     Detect anomalies based on reconstruction error threshold
     
@@ -109,12 +170,14 @@ def detect_anomalies(model, X, threshold):
         model: Trained autoencoder model
         X: Input sequences
         threshold: Anomaly threshold
+        errors: Precomputed reconstruction errors for X (skips the model)
         
     Returns:
         tuple: (predictions, reconstruction_errors)
             predictions: 0 for normal, 1 for anomaly
     """
-    errors = calculate_reconstruction_errors(model, X)
+    if errors is None:
+        errors = calculate_reconstruction_errors(model, X)
     predictions = (errors > threshold).astype(int)
     
     return predictions, errors
@@ -133,9 +196,24 @@ def evaluate_model(y_true, y_pred, errors, threshold):
     Returns:
         dict: Evaluation metrics
     """
-    # Confusion matrix
-    tn, fp, fn, tp = confusion_matrix(y_true, y_pred).ravel()
+    # Confusion matrix: count each (true, predicted) pair as bin 2*true + predicted
+    cells = (np.asarray(y_true, dtype=np.int64) << 1) | np.asarray(y_pred, dtype=np.int64)
+    tn, fp, fn, tp = np.bincount(cells, minlength=4).tolist()
+    
+    return metrics_from_confusion(tp, fp, tn, fn, threshold)
+
+
+def metrics_from_confusion(tp, fp, tn, fn, threshold):
+    """
+    Derive evaluation metrics from confusion-matrix counts
     
+    Args:
+        tp, fp, tn, fn: True/false positive and negative counts
+        threshold: Anomaly threshold the counts were obtained with
+        
+    Returns:
+        dict: Evaluation metrics
+    """
     # Calculate metrics
     accuracy = (tp + tn) / (tp + tn + fp + fn)
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0
@@ -234,6 +312,48 @@ def plot_training_history(history, save_path='models/training_history.png'):
     plt.close()
 
 
+def export_tflite(model, save_path='models/lstm_model.tflite'):
+    """
+    Export a trained model to TensorFlow Lite for lightweight inference
+    
+    Weights are kept in float32 so reconstruction errors stay comparable
+    to the threshold fit on the Keras model.
+    
+    Args:
+        model: Trained Keras model
+        save_path: Path to save the .tflite flatbuffer
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(save_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"[SAVED] TFLite model saved to: {save_path}")
+
+
+def tflite_reconstruction_errors(interpreter, X):
+    """
+    Calculate reconstruction errors with a TFLite interpreter
+    
+    Args:
+        interpreter: tf.lite.Interpreter for the exported autoencoder
+        X: Input sequences
+        
+    Returns:
+        np.array: Reconstruction errors (MSE) for each sample
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    
+    # Size the input for the whole batch, reallocating only when it changes
+    if tuple(interpreter.get_input_details()[0]['shape']) != X.shape:
+        interpreter.resize_tensor_input(input_index, X.shape)
+        interpreter.allocate_tensors()
+    
+    interpreter.set_tensor(input_index, X)
+    interpreter.invoke()
+    return reconstruction_errors(X, interpreter.get_tensor(output_index))
+
+
 def train_lstm_autoencoder(data_path='data/mock_traffic.csv', 
                            seq_length=10,
                            epochs=50,
@@ -265,28 +385,31 @@ def train_lstm_autoencoder(data_path='data/mock_traffic.csv',
     full_data_path = os.path.join(project_root, data_path)
     
     # Load data without timestamp column (it causes numerical issues)
-    df = pd.read_csv(full_data_path)
-    df = df.drop('ts', axis=1)  # Remove timestamp column
-    temp_path = full_data_path.replace('.csv', '_temp.csv')
-    df.to_csv(temp_path, index=False)
+    df = pd.read_csv(full_data_path, engine='pyarrow').drop('ts', axis=1)
     
     result = preprocess_pipeline(
-        file_path=temp_path,
+        df=df,
         numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
         label_col='label',
         create_seq=True,
         seq_length=seq_length
     )
     
-    # Clean up temp file
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
-    
     X_train = result['X_train']
     X_test = result['X_test']
     y_train = result['y_train']
     y_test = result['y_test']
     
+    # Save the fitted scaler so inference reuses the training statistics
+    scaler_path = os.path.join(project_root, 'models', 'scaler.pkl')
+    joblib.dump(result['scaler'], scaler_path)
+    print(f"[SAVED] Scaler saved to: {scaler_path}")
+    
+    # Save the held-out split so the prediction test can skip preprocessing
+    np.save(os.path.join(project_root, 'models', 'X_test.npy'), X_test)
+    np.save(os.path.join(project_root, 'models', 'y_test.npy'), y_test)
+    print(f"[SAVED] Test split saved to: {os.path.join(project_root, 'models')}")
+    
     print(f"\nData shapes:")
     print(f"  X_train: {X_train.shape}")
     print(f"  X_test: {X_test.shape}")
@@ -311,12 +434,18 @@ def train_lstm_autoencoder(data_path='data/mock_traffic.csv',
         ModelCheckpoint(model_save_path, monitor='val_loss', save_best_only=True, verbose=1)
     ]
     
+    # Input pipelines: reshuffle every epoch and build the next batch while
+    # the current one trains
+    train_ds = tf.data.Dataset.from_tensor_slices((X_train, X_train))
+    train_ds = train_ds.shuffle(SHUFFLE_BUFFER_SIZE).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    val_ds = tf.data.Dataset.from_tensor_slices((X_test, X_test))
+    val_ds = val_ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    
     # Train on all data (autoencoder learns to reconstruct)
     history = model.fit(
-        X_train, X_train,
+        train_ds,
         epochs=epochs,
-        batch_size=batch_size,
-        validation_data=(X_test, X_test),
+        validation_data=val_ds,
         callbacks=callbacks,
         verbose=1
     )
@@ -343,7 +472,7 @@ def train_lstm_autoencoder(data_path='data/mock_traffic.csv',
     
     # Step 5: Evaluate on training set
     print("\n[Step 5] Evaluating on training set...")
-    train_pred, train_errors_final = detect_anomalies(model, X_train, threshold)
+    train_pred, train_errors_final = detect_anomalies(model, X_train, threshold, errors=train_errors)
     train_metrics = evaluate_model(y_train, train_pred, train_errors_final, threshold)
     print_evaluation_report(train_metrics, "Training Set")
     
@@ -359,19 +488,24 @@ def train_lstm_autoencoder(data_path='data/mock_traffic.csv',
         f.write(f"{threshold}\n")
     print(f"[SAVED] Threshold saved to: {threshold_path}")
     
+    # Export the lightweight inference model
+    export_tflite(model, os.path.join(project_root, 'models', 'lstm_model.tflite'))
+    
     return model, threshold, test_metrics
 
 
 def test_model_loading_and_prediction(model_path='models/lstm_model.keras',
                                       threshold_path='models/threshold.txt',
-                                      data_path='data/mock_traffic.csv'):
+                                      data_path='data/mock_traffic.csv',
+                                      tflite_path='models/lstm_model.tflite'):
     """
     Test loading the trained model and making predictions
     
     Args:
-        model_path: Path to saved model
+        model_path: Path to saved model (used when no TFLite export exists)
         threshold_path: Path to saved threshold
-        data_path: Path to test data
+        data_path: Path to test data (only read if training saved no test split)
+        tflite_path: Path to the TFLite export of the model
     """
     print("\n" + "="*60)
     print("Testing Model Loading and Prediction")
@@ -381,10 +515,17 @@ def test_model_loading_and_prediction(model_path='models/lstm_model.keras',
     current_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_dir)
     
-    # Load model
-    full_model_path = os.path.join(project_root, model_path)
-    print(f"\n[1] Loading model from: {full_model_path}")
-    model = load_model(full_model_path)
+    # Load model, preferring the lighter TFLite runtime
+    full_tflite_path = os.path.join(project_root, tflite_path)
+    interpreter = None
+    if os.path.exists(full_tflite_path):
+        print(f"\n[1] Loading TFLite model from: {full_tflite_path}")
+        interpreter = tf.lite.Interpreter(model_path=full_tflite_path)
+        interpreter.allocate_tensors()
+    else:
+        full_model_path = os.path.join(project_root, model_path)
+        print(f"\n[1] Loading model from: {full_model_path}")
+        model = load_model(full_model_path)
     print("[LOADED] Model loaded successfully!")
     
     # Load threshold
@@ -394,30 +535,35 @@ def test_model_loading_and_prediction(model_path='models/lstm_model.keras',
         threshold = float(f.read().strip())
     print(f"[LOADED] Threshold loaded: {threshold:.6f}")
     
-    # Load sample data
-    full_data_path = os.path.join(project_root, data_path)
-    print(f"\n[3] Loading sample data from: {full_data_path}")
-    
-    # Load data without timestamp column
-    df_test = pd.read_csv(full_data_path)
-    df_test = df_test.drop('ts', axis=1)
-    temp_test_path = full_data_path.replace('.csv', '_temp_test.csv')
-    df_test.to_csv(temp_test_path, index=False)
-    
-    result = preprocess_pipeline(
-        file_path=temp_test_path,
-        numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
-        label_col='label',
-        create_seq=True,
-        seq_length=10
-    )
-    
-    # Clean up temp file
-    if os.path.exists(temp_test_path):
-        os.remove(temp_test_path)
-    
-    X_test = result['X_test']
-    y_test = result['y_test']
+    # Load sample data, reusing the test split saved by training if present
+    X_test_path = os.path.join(project_root, 'models', 'X_test.npy')
+    y_test_path = os.path.join(project_root, 'models', 'y_test.npy')
+    if os.path.exists(X_test_path) and os.path.exists(y_test_path):
+        print(f"\n[3] Loading saved test split from: {X_test_path}")
+        X_test = np.load(X_test_path, mmap_mode='r')
+        y_test = np.load(y_test_path)
+    else:
+        full_data_path = os.path.join(project_root, data_path)
+        print(f"\n[3] Loading sample data from: {full_data_path}")
+        
+        # Load data without timestamp column
+        df_test = pd.read_csv(full_data_path, engine='pyarrow').drop('ts', axis=1)
+        
+        # Scale with the training statistics rather than refitting on this data
+        scaler_path = os.path.join(project_root, 'models', 'scaler.pkl')
+        scaler = joblib.load(scaler_path) if os.path.exists(scaler_path) else None
+        
+        result = preprocess_pipeline(
+            df=df_test,
+            numeric_cols=['orig_pkts', 'resp_pkts', 'orig_bytes', 'resp_bytes'],
+            label_col='label',
+            create_seq=True,
+            seq_length=10,
+            scaler=scaler
+        )
+        
+        X_test = result['X_test']
+        y_test = result['y_test']
     
     # Make predictions on first 10 samples
     print(f"\n[4] Making predictions on {min(10, len(X_test))} samples...")
@@ -425,7 +571,11 @@ def test_model_loading_and_prediction(model_path='models/lstm_model.keras',
     sample_y = y_test[:10]
     
     # Predict
-    predictions, errors = detect_anomalies(model, sample_X, threshold)
+    if interpreter is not None:
+        errors = tflite_reconstruction_errors(interpreter, sample_X)
+        predictions = (errors > threshold).astype(int)
+    else:
+        predictions, errors = detect_anomalies(model, sample_X, threshold)
     
     print("\nPrediction Results:")
     print(f"{'Sample':<8} {'True Label':<12} {'Predicted':<12} {'Error':<12} {'Status':<10}")
@@ -471,7 +621,9 @@ if __name__ == "__main__":
         print("\n>>> All tasks completed successfully!")
         print("\nModel files created:")
         print("  - models/lstm_model.keras (trained model)")
+        print("  - models/lstm_model.tflite (TFLite inference model)")
         print("  - models/threshold.txt (anomaly threshold)")
+        print("  - models/X_test.npy, models/y_test.npy (held-out test split)")
         print("  - models/training_history.png (training plots)")
         
     except Exception as e:
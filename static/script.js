@@ -316,7 +316,7 @@ function updateMetrics(data) {
 // ============================================
 async function loadScanHistory() {
     try {
-        const response = await fetch('/history');
+        const response = await fetch('/history?limit=10');
         const history = await response.json();
         
         displayHistory(history);